@@ -13,10 +13,14 @@ Salida (al cierre de vela):
 """
 
 import numpy as np
-import pandas as pd
+from numba import njit
+from _indicators_kernels import tsi_core, psar_core
 from datetime import datetime, timedelta
 from ib_insync import *
 import logging
+import math
+import time
+from typing import Final
 
 # =============================================================================
 # CONFIGURACIÓN
@@ -32,14 +36,25 @@ SYMBOL = 'NQ'
 EXCHANGE = 'CME'
 
 # Parámetros de la estrategia
-TIMEFRAME_MINUTES = 5
-MA_PERIOD = 70
-TSI_FAST = 13
-TSI_SLOW = 25
-TSI_SIGNAL = 13  # No usado en esta estrategia, pero disponible
-TSI_THRESHOLD = -10
-PSAR_AF = 0.02
-PSAR_MAX_AF = 0.2
+TIMEFRAME_MINUTES: Final[int] = 5
+MA_PERIOD: Final[int] = 70
+TSI_FAST: Final[int] = 13
+TSI_SLOW: Final[int] = 25
+TSI_SIGNAL: Final[int] = 13  # No usado en esta estrategia, pero disponible
+TSI_THRESHOLD: Final[float] = -10
+PSAR_AF: Final[float] = 0.02
+PSAR_MAX_AF: Final[float] = 0.2
+
+# Duración de una vela en nanosegundos (para agrupar ticks por vela)
+TIMEFRAME_NS: Final[int] = TIMEFRAME_MINUTES * 60 * 1_000_000_000
+
+# Tipos de tick de IBKR que corresponden a una operación (tiempo real / diferido):
+# LAST (4/68) y LAST_SIZE (5/71), que ib_insync registra con price=ticker.last
+# cuando se opera al mismo precio que la operación anterior
+LAST_TICK_TYPES: Final[tuple] = (4, 68, 5, 71)
+
+# Velas cerradas que se mantienen en memoria
+MAX_BARS: Final[int] = MA_PERIOD + TSI_SLOW + 100
 
 # Cantidad a operar
 QUANTITY = 1
@@ -60,66 +75,31 @@ logger = logging.getLogger(__name__)
 # INDICADORES
 # =============================================================================
 
-def calculate_tsi(close: pd.Series, fast: int = 13, slow: int = 25) -> pd.Series:
+# Núcleos precompilados (python _indicators_aot.py). Si no están
+# disponibles se compilan con numba en la primera llamada y se guardan
+# en caché. Ambas versiones salen de _indicators_kernels.py y usan las
+# mismas opciones de compilación (sin fastmath, que pycc no admite).
+try:
+    from tsi_kernels import tsi_core as _tsi_core, psar_core as _psar_core
+except ImportError:
+    _tsi_core = njit(cache=True)(tsi_core)
+    _psar_core = njit(cache=True)(psar_core)
+
+
+def calculate_tsi(close: np.ndarray, fast: int = 13, slow: int = 25) -> np.ndarray:
     """
     Calcula el True Strength Index (TSI).
     TSI = 100 * EMA(EMA(momentum, slow), fast) / EMA(EMA(abs(momentum), slow), fast)
     """
-    momentum = close.diff()
-    
-    # Doble suavizado del momentum
-    ema_slow = momentum.ewm(span=slow, adjust=False).mean()
-    ema_fast = ema_slow.ewm(span=fast, adjust=False).mean()
-    
-    # Doble suavizado del momentum absoluto
-    abs_ema_slow = momentum.abs().ewm(span=slow, adjust=False).mean()
-    abs_ema_fast = abs_ema_slow.ewm(span=fast, adjust=False).mean()
-    
-    tsi = 100 * ema_fast / abs_ema_fast
-    return tsi
+    return _tsi_core(close, 2.0 / (slow + 1), 2.0 / (fast + 1))
 
 
-def calculate_parabolic_sar(high: pd.Series, low: pd.Series, 
-                            af_start: float = 0.02, af_max: float = 0.2) -> pd.Series:
+def calculate_parabolic_sar(high: np.ndarray, low: np.ndarray, 
+                            af_start: float = 0.02, af_max: float = 0.2) -> np.ndarray:
     """
     Calcula el Parabolic SAR.
     """
-    length = len(high)
-    sar = pd.Series(index=high.index, dtype=float)
-    af = af_start
-    uptrend = True
-    ep = low.iloc[0]  # Extreme point
-    sar.iloc[0] = high.iloc[0]
-    
-    for i in range(1, length):
-        if uptrend:
-            sar.iloc[i] = sar.iloc[i-1] + af * (ep - sar.iloc[i-1])
-            sar.iloc[i] = min(sar.iloc[i], low.iloc[i-1], low.iloc[i-2] if i >= 2 else low.iloc[i-1])
-            
-            if low.iloc[i] < sar.iloc[i]:
-                uptrend = False
-                sar.iloc[i] = ep
-                ep = low.iloc[i]
-                af = af_start
-            else:
-                if high.iloc[i] > ep:
-                    ep = high.iloc[i]
-                    af = min(af + af_start, af_max)
-        else:
-            sar.iloc[i] = sar.iloc[i-1] + af * (ep - sar.iloc[i-1])
-            sar.iloc[i] = max(sar.iloc[i], high.iloc[i-1], high.iloc[i-2] if i >= 2 else high.iloc[i-1])
-            
-            if high.iloc[i] > sar.iloc[i]:
-                uptrend = True
-                sar.iloc[i] = ep
-                ep = high.iloc[i]
-                af = af_start
-            else:
-                if low.iloc[i] < ep:
-                    ep = low.iloc[i]
-                    af = min(af + af_start, af_max)
-    
-    return sar
+    return _psar_core(high, low, af_start, af_max)
 
 
 # =============================================================================
@@ -127,18 +107,47 @@ def calculate_parabolic_sar(high: pd.Series, low: pd.Series,
 # =============================================================================
 
 class TSITradingBot:
+    __slots__ = (
+        'ib', 'contract',
+        '_o', '_h', '_l', '_c', '_n', '_ma_sum',
+        '_cb_o', '_cb_h', '_cb_l', '_cb_c', 'bar_bucket', 'bar_start_time',
+        '_bucket_ns_width',
+        'in_position', 'position_entry_price', 'last_price', '_prev_state',
+        '_tsi_thresh',
+        'current_tsi', 'current_ma70', 'ma70_slope', 'current_sar',
+        '__weakref__',  # ib_insync guarda los callbacks (self._on_tick) con weakref
+    )
+    
     def __init__(self):
         self.ib = IB()
         self.contract = None
-        self.bars_5min = pd.DataFrame()
-        self.current_bar = {'open': None, 'high': None, 'low': None, 'close': None, 'volume': 0}
-        self.bar_start_time = None
+        
+        # Velas cerradas (una columna por array). Se reserva el doble de
+        # MAX_BARS para escribir siempre al final y compactar sólo cuando
+        # se llena, así las ventanas que reciben los indicadores son
+        # vistas contiguas sin copias.
+        self._o = np.empty(2 * MAX_BARS, dtype=np.float64)
+        self._h = np.empty(2 * MAX_BARS, dtype=np.float64)
+        self._l = np.empty(2 * MAX_BARS, dtype=np.float64)
+        self._c = np.empty(2 * MAX_BARS, dtype=np.float64)
+        self._n = 0  # Posición de escritura
+        self._ma_sum = 0.0  # Suma de los últimos MA_PERIOD cierres
+        
+        # Vela en curso (nan = sin iniciar)
+        self._cb_o = math.nan
+        self._cb_h = math.nan
+        self._cb_l = math.nan
+        self._cb_c = math.nan
+        self.bar_bucket = -1  # Índice de la vela actual (epoch // TIMEFRAME_NS)
+        self._bucket_ns_width = TIMEFRAME_NS  # Copia para no leer la global en cada tick
+        self.bar_start_time = None  # Solo para logging
         
         # Estado de la estrategia
         self.in_position = False
         self.position_entry_price = None
         self.last_price = None
-        self.price_was_above_ma = None  # Para detectar cruce
+        self._prev_state = -1  # Para detectar cruce: 1 encima de MA70, 0 debajo, -1 sin iniciar
+        self._tsi_thresh = TSI_THRESHOLD  # Copia para no leer la global en cada tick
         
         # Indicadores actuales
         self.current_tsi = None
@@ -183,87 +192,149 @@ class TSITradingBot:
         if not bars:
             raise ValueError("No se pudieron obtener datos históricos")
         
-        # Convertir a DataFrame
-        self.bars_5min = util.df(bars)
-        self.bars_5min.set_index('date', inplace=True)
-        
-        logger.info(f"Cargadas {len(self.bars_5min)} barras de {TIMEFRAME_MINUTES} min")
-        logger.info(f"Desde: {self.bars_5min.index[0]} hasta: {self.bars_5min.index[-1]}")
-        
-        # Calcular indicadores iniciales
-        self._update_indicators()
+        logger.info(f"Cargadas {len(bars)} barras de {TIMEFRAME_MINUTES} min")
+        logger.info(f"Desde: {bars[0].date} hasta: {bars[-1].date}")
+        
+        # Guardar solo las últimas MAX_BARS velas
+        self._n = 0
+        self._ma_sum = 0.0
+        for bar in bars[-MAX_BARS:]:
+            self._append_bar(bar.open, bar.high, bar.low, bar.close)
+        
+        # Calcular indicadores iniciales con todo el histórico descargado,
+        # no solo con las velas que se guardan (el TSI y sobre todo el
+        # Parabolic SAR dependen del punto de arranque)
+        self._update_indicators(
+            np.array([bar.close for bar in bars], dtype=np.float64),
+            np.array([bar.high for bar in bars], dtype=np.float64),
+            np.array([bar.low for bar in bars], dtype=np.float64)
+        )
         
-    def _update_indicators(self):
-        """Recalcula los indicadores con los datos actuales."""
-        if len(self.bars_5min) < MA_PERIOD:
+    def _append_bar(self, open_: float, high: float, low: float, close: float):
+        """Añade una vela cerrada a los buffers."""
+        if self._n == self._c.shape[0]:
+            # Buffer lleno: mover las últimas MAX_BARS velas al principio
+            for arr in (self._o, self._h, self._l, self._c):
+                arr[:MAX_BARS] = arr[-MAX_BARS:]
+            self._n = MAX_BARS
+            # Recalcular la suma exacta para no acumular error de redondeo
+            self._ma_sum = self._c[MAX_BARS - MA_PERIOD:MAX_BARS].sum()
+        
+        n = self._n
+        self._o[n] = open_
+        self._h[n] = high
+        self._l[n] = low
+        self._c[n] = close
+        self._n = n + 1
+        
+        # Suma móvil de MA70: entra el cierre nuevo y sale el de hace MA_PERIOD velas
+        self._ma_sum += close
+        if n >= MA_PERIOD:
+            self._ma_sum -= self._c[n - MA_PERIOD]
+    
+    def _window(self, arr: np.ndarray) -> np.ndarray:
+        """Vista contigua de las últimas MAX_BARS velas de un buffer."""
+        return arr[max(0, self._n - MAX_BARS):self._n]
+    
+    def _update_indicators(self, closes: np.ndarray = None,
+                           highs: np.ndarray = None, lows: np.ndarray = None):
+        """
+        Recalcula los indicadores con los datos actuales.
+        Por defecto usa las velas guardadas; en la carga inicial recibe
+        el histórico completo.
+        """
+        if closes is None:
+            # Vistas float64 contiguas, se obtienen una sola vez por actualización
+            closes = self._window(self._c)
+            highs = self._window(self._h)
+            lows = self._window(self._l)
+        
+        if len(closes) < MA_PERIOD:
             return
-            
-        # MA70
-        self.bars_5min['MA70'] = self.bars_5min['close'].rolling(MA_PERIOD).mean()
         
-        # Pendiente de MA70 (comparando con valor anterior)
-        self.bars_5min['MA70_slope'] = self.bars_5min['MA70'].diff()
+        # MA70 a partir de la suma móvil que mantiene _append_bar
+        ma70 = self._ma_sum / MA_PERIOD
+        
+        # Pendiente de MA70 (comparando con valor anterior): solo cambian
+        # el cierre que entra y el que sale de la ventana
+        if len(closes) > MA_PERIOD:
+            ma70_slope = (closes[-1] - closes[-MA_PERIOD - 1]) / MA_PERIOD
+        else:
+            ma70_slope = np.nan
         
         # TSI
-        self.bars_5min['TSI'] = calculate_tsi(
-            self.bars_5min['close'], 
+        tsi = calculate_tsi(
+            closes, 
             fast=TSI_FAST, 
             slow=TSI_SLOW
         )
         
         # Parabolic SAR
-        self.bars_5min['PSAR'] = calculate_parabolic_sar(
-            self.bars_5min['high'],
-            self.bars_5min['low'],
+        sar = calculate_parabolic_sar(
+            highs,
+            lows,
             af_start=PSAR_AF,
             af_max=PSAR_MAX_AF
         )
         
         # Actualizar valores actuales
-        self.current_ma70 = self.bars_5min['MA70'].iloc[-1]
-        self.ma70_slope = self.bars_5min['MA70_slope'].iloc[-1]
-        self.current_tsi = self.bars_5min['TSI'].iloc[-1]
-        self.current_sar = self.bars_5min['PSAR'].iloc[-1]
-        
-        logger.debug(f"Indicadores - MA70: {self.current_ma70:.2f}, "
-                    f"Slope: {self.ma70_slope:.4f}, TSI: {self.current_tsi:.2f}, "
-                    f"SAR: {self.current_sar:.2f}")
-    
-    def _get_bar_start_time(self, timestamp: datetime) -> datetime:
-        """Calcula el inicio de la barra de 5 minutos para un timestamp dado."""
-        minutes = (timestamp.minute // TIMEFRAME_MINUTES) * TIMEFRAME_MINUTES
-        return timestamp.replace(minute=minutes, second=0, microsecond=0)
+        self.current_ma70 = float(ma70)
+        self.ma70_slope = float(ma70_slope)
+        self.current_tsi = float(tsi[-1])
+        self.current_sar = float(sar[-1])
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Indicadores - MA70: {self.current_ma70:.2f}, "
+                        f"Slope: {self.ma70_slope:.4f}, TSI: {self.current_tsi:.2f}, "
+                        f"SAR: {self.current_sar:.2f}")
     
     def _on_tick(self, ticker: Ticker):
-        """Callback para cada tick recibido."""
-        if ticker.last is None or np.isnan(ticker.last):
-            return
-            
-        price = ticker.last
-        now = datetime.now()
-        
-        # Actualizar barra actual
-        bar_start = self._get_bar_start_time(now)
-        
-        if self.bar_start_time != bar_start:
-            # Nueva barra - cerrar la anterior y abrir nueva
-            if self.bar_start_time is not None and self.current_bar['open'] is not None:
+        """
+        Callback para cada lote de ticks recibido.
+        ib_insync emite updateEvent una vez por paquete de red, con todos
+        los ticks del paquete en ticker.ticks: la vela se actualiza con el
+        máximo/mínimo/último precio del lote y el cruce se comprueba solo
+        con el último.
+        """
+        # Cambio de vela: se cierra la anterior con cualquier actualización
+        # del ticker, aunque el lote no traiga operaciones
+        bucket = time.time_ns() // self._bucket_ns_width
+        
+        if self.bar_bucket != bucket:
+            if self.bar_bucket != -1 and not math.isnan(self._cb_o):
                 self._close_bar()
             
-            self.bar_start_time = bar_start
-            self.current_bar = {
-                'open': price,
-                'high': price,
-                'low': price,
-                'close': price,
-                'volume': 0
-            }
-            logger.info(f"Nueva barra iniciada: {bar_start}")
+            # La nueva vela se abre con la primera operación del intervalo
+            self.bar_bucket = bucket
+            self.bar_start_time = datetime.fromtimestamp(bucket * TIMEFRAME_MINUTES * 60)
+            self._cb_o = self._cb_h = self._cb_l = self._cb_c = math.nan
+        
+        # Precios de operaciones del lote (descarta nan y precios vacíos)
+        prices = [t.price for t in ticker.ticks
+                  if t.tickType in LAST_TICK_TYPES and t.price > 0]
+        if not prices:
+            # Lote solo con bid/ask u otros datos: nada más que hacer
+            return
+            
+        price = prices[-1]
+        batch_high = max(prices)
+        batch_low = min(prices)
+        
+        if math.isnan(self._cb_o):
+            # Abrir la vela actual
+            self._cb_o = prices[0]
+            self._cb_h = batch_high
+            self._cb_l = batch_low
+            self._cb_c = price
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f"Nueva barra iniciada: {self.bar_start_time}")
         else:
             # Actualizar barra actual
-            self.current_bar['high'] = max(self.current_bar['high'], price)
-            self.current_bar['low'] = min(self.current_bar['low'], price)
-            self.current_bar['close'] = price
+            if batch_high > self._cb_h:
+                self._cb_h = batch_high
+            if batch_low < self._cb_l:
+                self._cb_l = batch_low
+            self._cb_c = price
         
         self.last_price = price
         
@@ -272,31 +343,18 @@ class TSITradingBot:
         
     def _close_bar(self):
         """Cierra la barra actual y la añade al histórico."""
-        if self.current_bar['open'] is None:
+        if math.isnan(self._cb_o):
             return
             
-        # Añadir barra al DataFrame
-        new_bar = pd.DataFrame([{
-            'open': self.current_bar['open'],
-            'high': self.current_bar['high'],
-            'low': self.current_bar['low'],
-            'close': self.current_bar['close'],
-            'volume': self.current_bar['volume']
-        }], index=[self.bar_start_time])
-        
-        self.bars_5min = pd.concat([self.bars_5min, new_bar])
-        
-        # Mantener solo las últimas N barras para no consumir memoria
-        max_bars = MA_PERIOD + TSI_SLOW + 100
-        if len(self.bars_5min) > max_bars:
-            self.bars_5min = self.bars_5min.iloc[-max_bars:]
+        # Añadir barra al histórico
+        self._append_bar(self._cb_o, self._cb_h, self._cb_l, self._cb_c)
         
         # Recalcular indicadores
         self._update_indicators()
         
-        logger.info(f"Barra cerrada: O={self.current_bar['open']:.2f} "
-                   f"H={self.current_bar['high']:.2f} L={self.current_bar['low']:.2f} "
-                   f"C={self.current_bar['close']:.2f}")
+        logger.info(f"Barra cerrada: O={self._cb_o:.2f} "
+                   f"H={self._cb_h:.2f} L={self._cb_l:.2f} "
+                   f"C={self._cb_c:.2f}")
         
         # Verificar salida al cierre de vela
         self._check_exit_conditions()
@@ -306,35 +364,34 @@ class TSITradingBot:
         if self.in_position:
             return
             
-        if self.current_ma70 is None or self.current_tsi is None:
+        # MA70 y TSI se calculan juntos: basta con comprobar uno
+        ma70 = self.current_ma70
+        if ma70 is None:
             return
         
-        # Determinar si el precio está por encima o por debajo de MA70
-        price_above_ma = price > self.current_ma70
+        # Estado respecto a MA70: 1 encima, 0 debajo
+        state = 1 if price > ma70 else 0
+        prev_state = self._prev_state
+        self._prev_state = state
         
-        # Inicializar estado si es la primera vez
-        if self.price_was_above_ma is None:
-            self.price_was_above_ma = price_above_ma
+        # Cruce hacia abajo solo si se pasa de 1 a 0 (con -1 no hay estado previo)
+        if prev_state <= state:
             return
         
-        # Detectar cruce hacia abajo
-        crossed_down = self.price_was_above_ma and not price_above_ma
+        # El resto de valores solo se leen cuando hay cruce
+        slope = self.ma70_slope
+        tsi = self.current_tsi
+        threshold = self._tsi_thresh
         
-        # Actualizar estado
-        self.price_was_above_ma = price_above_ma
+        # Evitar formatear los mensajes si el nivel INFO está desactivado
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"Cruce detectado: precio {price:.2f} cruzó MA70 {ma70:.2f}")
+            logger.info(f"Condiciones - MA descendente: {slope < 0} (slope: {slope:.4f}), "
+                       f"TSI < {threshold}: {tsi < threshold} (TSI: {tsi:.2f})")
         
-        if crossed_down:
-            logger.info(f"Cruce detectado: precio {price:.2f} cruzó MA70 {self.current_ma70:.2f}")
-            
-            # Verificar otras condiciones
-            ma_descending = self.ma70_slope < 0
-            tsi_below_threshold = self.current_tsi < TSI_THRESHOLD
-            
-            logger.info(f"Condiciones - MA descendente: {ma_descending} (slope: {self.ma70_slope:.4f}), "
-                       f"TSI < {TSI_THRESHOLD}: {tsi_below_threshold} (TSI: {self.current_tsi:.2f})")
-            
-            if ma_descending and tsi_below_threshold:
-                self._enter_short(price)
+        # Verificar otras condiciones (primero la pendiente, la más barata)
+        if slope < 0 and tsi < threshold:
+            self._enter_short(price)
     
     def _check_exit_conditions(self):
         """Verifica condiciones de salida al cierre de vela."""
@@ -345,7 +402,7 @@ class TSITradingBot:
             return
         
         # Salida: high de la vela cerrada >= SAR
-        last_high = self.bars_5min['high'].iloc[-1]
+        last_high = float(self._h[self._n - 1])
         
         if last_high >= self.current_sar:
             logger.info(f"Señal de salida: High {last_high:.2f} >= SAR {self.current_sar:.2f}")
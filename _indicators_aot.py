@@ -0,0 +1,25 @@
+"""
+Compilación AOT de los núcleos de indicadores
+==============================================
+Genera el módulo nativo `tsi_kernels` con los núcleos del TSI y del
+Parabolic SAR (_indicators_kernels.py) para que los bots no tengan que
+compilarlos con numba al arrancar:
+
+    python _indicators_aot.py
+
+Si el módulo no está compilado, los bots usan las versiones @njit.
+"""
+
+import os
+from numba.pycc import CC
+from _indicators_kernels import tsi_core, psar_core
+
+cc = CC('tsi_kernels')
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+
+cc.export('tsi_core', 'f8[:](f8[:], f8, f8)')(tsi_core)
+cc.export('psar_core', 'f8[:](f8[:], f8[:], f8, f8)')(psar_core)
+
+
+if __name__ == '__main__':
+    cc.compile()
@@ -0,0 +1,85 @@
+"""
+Núcleos de los indicadores
+==========================
+Definición única, en Python puro, de los núcleos del TSI y del
+Parabolic SAR. Los bots los compilan con numba (@njit) y
+_indicators_aot.py los exporta al módulo nativo `tsi_kernels`, así
+ambas versiones parten siempre del mismo código.
+"""
+
+import numpy as np
+
+
+def tsi_core(close: np.ndarray, a_slow: float, a_fast: float) -> np.ndarray:
+    """
+    Núcleo del TSI: las cuatro EMAs en una sola pasada.
+    Equivale a ewm(adjust=False) sobre close.diff() (la primera EMA
+    arranca en el primer momentum válido).
+    """
+    n = close.shape[0]
+    out = np.full(n, np.nan)
+    if n < 2:
+        return out
+    
+    m = close[1] - close[0]
+    e1 = m          # EMA(momentum, slow)
+    e2 = m          # EMA(EMA(momentum, slow), fast)
+    e3 = abs(m)     # EMA(abs(momentum), slow)
+    e4 = e3         # EMA(EMA(abs(momentum), slow), fast)
+    out[1] = 100.0 * e2 / e4 if e4 != 0 else np.nan
+    
+    for i in range(2, n):
+        m = close[i] - close[i-1]
+        e1 += a_slow * (m - e1)
+        e2 += a_fast * (e1 - e2)
+        e3 += a_slow * (abs(m) - e3)
+        e4 += a_fast * (e3 - e4)
+        out[i] = 100.0 * e2 / e4 if e4 != 0 else np.nan
+    
+    return out
+
+
+def psar_core(high: np.ndarray, low: np.ndarray,
+               af_start: float, af_max: float) -> np.ndarray:
+    """
+    Núcleo del Parabolic SAR sobre arrays float64.
+    """
+    length = high.shape[0]
+    sar = np.empty(length, dtype=np.float64)
+    if length == 0:
+        return sar
+    af = af_start
+    uptrend = True
+    ep = low[0]  # Extreme point
+    sar[0] = high[0]
+    
+    for i in range(1, length):
+        prev = sar[i-1] + af * (ep - sar[i-1])
+        if uptrend:
+            prev = min(prev, low[i-1], low[i-2] if i >= 2 else low[i-1])
+            
+            if low[i] < prev:
+                uptrend = False
+                sar[i] = ep
+                ep = low[i]
+                af = af_start
+            else:
+                sar[i] = prev
+                if high[i] > ep:
+                    ep = high[i]
+                    af = min(af + af_start, af_max)
+        else:
+            prev = max(prev, high[i-1], high[i-2] if i >= 2 else high[i-1])
+            
+            if high[i] > prev:
+                uptrend = True
+                sar[i] = ep
+                ep = high[i]
+                af = af_start
+            else:
+                sar[i] = prev
+                if low[i] < ep:
+                    ep = low[i]
+                    af = min(af + af_start, af_max)
+    
+    return sar